@@ -5,9 +5,12 @@ Uses column-letter mapping to fill a PDF form from all sheets in the Excel file,
 naming output files by sequential row number.
 """
 
+import functools
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import numpy as np
 import pandas as pd
 from pdfrw import PdfReader, PdfWriter
 from dateutil import parser as dateparser
@@ -15,12 +18,15 @@ from dateutil import parser as dateparser
 # ---------- CONFIG ----------
 TEMPLATE_PATH = "fillable_form_new.pdf"
 EXCEL_PATH = "google_form_responses.xlsx"
+YEAR_STR = "2026" # value written to the "year" field of every form
 SHEET_NAME = "GOOGLE Responses BATCH 1" # This variable is ignored in the main function now, but kept for context/legacy
 OUT_DIR = "output_forms"
 OUT_EDITABLE = os.path.join(OUT_DIR, "editable")
 OUT_FLATTENED = os.path.join(OUT_DIR, "flattened")
-# os.makedirs(OUT_EDITABLE, exist_ok=True) # Removed from top, added to loop for safety
-# os.makedirs(OUT_FLATTENED, exist_ok=True) # Removed from top, added to loop for safety
+# Path prefixes so per-row output names are a plain f-string concatenation
+EDIT_PREFIX = OUT_EDITABLE + os.sep
+FLAT_PREFIX = OUT_FLATTENED + os.sep
+# Output directories are created once in main(), before any row is processed
 
 # Column-letter -> internal field keys (based on your mapping)
 COL_MAP = {
@@ -75,17 +81,71 @@ CHECKBOX_GROUPS = {
     "marital": ("married", "single"),
     "disability": ("disabled", "not_disabled"),
 }
+CHECKBOX_FIELDS = frozenset(f for group in CHECKBOX_GROUPS.values() for f in group)
+
+# Full-date formats tried with strptime before falling back to dateutil.
+# Each also has " %H:%M:%S" and " %H:%M:%S/%f" variants: real Excel date cells read
+# with dtype=str come through as "1990-03-04 00:00:00" (or "... 10:30:15.123000",
+# whose "." has become "/" by the time these run) and must parse the same as typed text.
+# Unlike dateutil(dayfirst=True), year-first dates are always Y/M/D, and 2-digit
+# years use strptime's pivot (69-99 -> 19xx, 00-68 -> 20xx).
+# Partial dates (e.g. "12/05") are left to dateutil so missing parts keep
+# being filled the same way as before.
+_FAST_DATE_BASES = ("%d/%m/%Y", "%d/%m/%y", "%Y/%m/%d")
+FAST_DATE_FORMATS = _FAST_DATE_BASES + tuple(
+    f"{fmt} {time_fmt}" for time_fmt in ("%H:%M:%S", "%H:%M:%S/%f") for fmt in _FAST_DATE_BASES
+)
+
+# Regexes used per row, compiled once
+_ORDINAL_RE = re.compile(r'(?<=\d)(st|nd|rd|th)\b', re.IGNORECASE)
+_NUM_RE = re.compile(r'\d{1,4}')
+# first 4-digit run anywhere, else first 2-digit run (a plain (\d{4})|(\d{2}) would
+# match the day in "12/05/2024" before ever reaching the year)
+_YEAR_RE = re.compile(r'(?:.*?(\d{4})|.*?(\d{2}))', re.DOTALL)
+_NAME_SPLIT_RE = re.compile(r'\s+')
 
 # ---------- helpers ----------
-def col_letter_to_index(letter):
-    letter = letter.strip().upper()
+def _base26_index(letter):
     idx = 0
     for ch in letter:
-        if not ('A' <= ch <= 'Z'):
-            raise ValueError(f"Invalid column letter: {letter}")
         idx = idx * 26 + (ord(ch) - ord('A') + 1)
     return idx - 1
 
+# A..Z and AA..ZZ (the 702 columns an Excel sheet realistically uses) -> 0-based index
+_LETTERS = [chr(c) for c in range(ord('A'), ord('Z') + 1)]
+_LETTER_TO_IDX = {
+    letter: _base26_index(letter)
+    for letter in _LETTERS + [a + b for a in _LETTERS for b in _LETTERS]
+}
+
+def col_letter_to_index(letter):
+    letter = letter.strip().upper()
+    try:
+        return _LETTER_TO_IDX[letter]
+    except KeyError:
+        raise ValueError(f"Invalid column letter: {letter}") from None
+
+# Column-letter -> 0-based index, computed once at import
+COL_IDX = {letter: col_letter_to_index(letter) for letter in COL_MAP}
+TIMESTAMP_IDX = col_letter_to_index("B")
+
+# Only these columns are pulled out of the sheet: the COL_MAP cells in order, then the timestamp
+ROW_KEYS = tuple(COL_MAP.values())
+NEEDED_IDX = np.fromiter([*COL_IDX.values(), TIMESTAMP_IDX], dtype=np.int64)
+
+def gather_columns(df):
+    """Return a 2D object array holding just the NEEDED_IDX columns of df."""
+    # Only the needed columns are converted to NumPy, not the whole sheet
+    mat = np.full((len(df), len(NEEDED_IDX)), None, dtype=object)
+    # columns past the sheet's width stay None (read back as "")
+    present = NEEDED_IDX < df.shape[1]
+    mat[:, present] = df.iloc[:, NEEDED_IDX[present]].to_numpy(dtype=object)
+    return mat
+
+def row_has_data(row):
+    """True if any COL_MAP cell of a gathered row holds text (a timestamp alone doesn't count)."""
+    return any(isinstance(v, str) and v.strip() for v in row[:len(ROW_KEYS)])
+
 def get_cell_by_letter(series, letter):
     try:
         idx = col_letter_to_index(letter)
@@ -93,6 +153,16 @@ def get_cell_by_letter(series, letter):
     except Exception:
         return None
 
+def read_all_sheets(source):
+    """Read every sheet as str columns, using the native calamine engine when installed."""
+    try:
+        return pd.read_excel(source, sheet_name=None, dtype=str, header=0, engine="calamine")
+    except ImportError:
+        # python-calamine not available: fall back to the pure-Python openpyxl reader
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return pd.read_excel(source, sheet_name=None, dtype=str, header=0, engine="openpyxl")
+
 def norm(v):
     if v is None:
         return ""
@@ -100,20 +170,31 @@ def norm(v):
 
 def parse_date_flexible(text):
     """Return (day, month, year) as zero-padded strings if parseable, else ('','','')."""
-    t = norm(text)
+    return _parse_date_str(norm(text))
+
+@functools.lru_cache(maxsize=4096)
+def _parse_date_str(t):
+    # Cached on the normalised cell string; the same DOBs repeat across rows
     if not t:
         return "", "", ""
     # remove ordinal suffixes: 1st, 2nd, 3rd, 4th...
-    t = re.sub(r'(?<=\d)(st|nd|rd|th)\b', '', t, flags=re.IGNORECASE)
+    t = _ORDINAL_RE.sub('', t)
     t = t.replace('.', '/').replace('-', '/')
-    # Try dateutil with dayfirst
+    # Fast path: try the common known formats with strptime first
+    for fmt in FAST_DATE_FORMATS:
+        try:
+            d = datetime.strptime(t, fmt)
+            return f"{d.day:02d}", f"{d.month:02d}", str(d.year)
+        except ValueError:
+            pass
+    # Try dateutil with dayfirst (slower, but tolerant of free text)
     try:
         d = dateparser.parse(t, dayfirst=True, fuzzy=True)
         return f"{d.day:02d}", f"{d.month:02d}", str(d.year)
     except Exception:
         pass
     # Fallback: extract 3 number groups (DD MM YYYY or DD MM YY)
-    parts = re.findall(r'\d{1,4}', t)
+    parts = _NUM_RE.findall(t)
     if len(parts) >= 3:
         day = parts[0]
         month = parts[1]
@@ -125,10 +206,36 @@ def parse_date_flexible(text):
         return day.zfill(2), month.zfill(2), year
     return "", "", ""
 
+def _date_cache_clear():
+    _parse_date_str.cache_clear()
+
+def set_checkbox_values(row_values):
+    """Turn the raw gender/marital/disabled answers into "Yes"/"" for each checkbox field."""
+    gender_raw = norm(row_values.get("gender", ""))
+    row_values["male"] = "Yes" if gender_raw.lower().startswith("m") else ""
+    row_values["female"] = "Yes" if gender_raw.lower().startswith("f") else ""
+
+    marital_raw = norm(row_values.get("marital", ""))
+    row_values["married"] = "Yes" if "married" in marital_raw.lower() else ""
+    row_values["single"] = "Yes" if "single" in marital_raw.lower() else ""
+
+    dis_raw = norm(row_values.get("disabled", ""))
+    if dis_raw:
+        if dis_raw.lower().startswith("y"):
+            row_values["disabled"] = "Yes"
+            row_values["not_disabled"] = ""
+        else:
+            row_values["disabled"] = ""
+            row_values["not_disabled"] = "Yes"
+    else:
+        row_values["disabled"] = ""
+        row_values["not_disabled"] = ""
+
 # ---------- PDF filling ----------
-def fill_pdf(template_path, output_edit_path, output_flat_path, row_values):
-    # Re-read the template every time for robustness
-    pdf = PdfReader(template_path) 
+def fill_pdf(template_bytes, row_values, *, out_edit=None, out_flat=None):
+    # Either output may be skipped by passing None; each write is a full PDF serialization
+    # Parse a fresh tree from the in-memory template bytes (no disk read per row)
+    pdf = PdfReader(fdata=template_bytes)
     
     for page in pdf.pages:
         if page.Annots:
@@ -142,10 +249,9 @@ def fill_pdf(template_path, output_edit_path, output_flat_path, row_values):
 
                     value = norm(row_values.get(field_name, ""))
 
-                    # checkboxes
-                    if field_name in sum(CHECKBOX_GROUPS.values(), ()):
-                        annot.AS = '/Yes' if value and value.lower().startswith('y') or value.lower().startswith('m') or value.lower().startswith('mar') else '/Off'
-                        # above is permissive; specific logic applied when building row_values
+                    # checkboxes: row_values already holds "Yes" or "" for each box
+                    if field_name in CHECKBOX_FIELDS:
+                        annot.AS = '/Yes' if value == "Yes" else '/Off'
                         continue
 
                     # set value and try to set appearance to allow auto-scaling (best-effort)
@@ -165,19 +271,126 @@ def fill_pdf(template_path, output_edit_path, output_flat_path, row_values):
                             pass
 
     # Write the editable PDF
-    PdfWriter(output_edit_path, trailer=pdf).write()
+    if out_edit is not None:
+        PdfWriter(out_edit, trailer=pdf).write()
     
     # Flatten (remove annotations/fields) and write the flattened PDF
-    for page in pdf.pages:
-        if "/Annots" in page:
-            page.Annots = []
-    PdfWriter(output_flat_path, trailer=pdf).write()
+    if out_flat is not None:
+        for page in pdf.pages:
+            if "/Annots" in page:
+                page.Annots = []
+        PdfWriter(out_flat, trailer=pdf).write()
+
+# ---------- per-row work (runs in worker processes) ----------
+_TEMPLATE_BYTES = None
+
+def _init_worker(template_bytes):
+    # Runs once per worker process so the template isn't pickled with every task
+    global _TEMPLATE_BYTES
+    _TEMPLATE_BYTES = template_bytes
+
+def fill_template_pdf(row_values, *, out_edit=None, out_flat=None):
+    """fill_pdf using the template bytes handed to this worker by _init_worker."""
+    fill_pdf(_TEMPLATE_BYTES, row_values, out_edit=out_edit, out_flat=out_flat)
+
+def fill_pdf_batch(template_bytes, jobs):
+    """Write the flattened PDF for each (row_values, out_flat) job. Returns how many were written."""
+    for row_values, out_flat in jobs:
+        fill_pdf(template_bytes, row_values, out_flat=out_flat)
+    return len(jobs)
+
+def process_row(args):
+    """Build the field values for one row and write its PDFs. Returns (i, ok, err)."""
+    i, padding, declaration_date, row = args
+
+    # Populate simple mapped fields from COL_MAP (row comes from gather_columns)
+    row_values = dict(zip(ROW_KEYS, map(norm, row)))
+
+    # --- extract only the year from the timestamp column (B) ---
+    timestamp = norm(row[-1])
+    year_part = ""
+    if timestamp:
+        # Try to extract a 4-digit or 2-digit year
+        m = _YEAR_RE.match(timestamp)
+        y4, y2 = (m.group(1), m.group(2)) if m else (None, None)
+        year_part = y4 or ("20" + y2 if y2 else "")
+    row_values["year"] = year_part
+
+    # split name in name_cell -> surname, first_name
+    name_cell = row_values.get("name_cell", "")
+    surname = ""
+    first_name = ""
+    if name_cell:
+        parts = _NAME_SPLIT_RE.split(name_cell.strip())
+        if len(parts) >= 1:
+            surname = parts[0]
+            first_name = " ".join(parts[1:]) if len(parts) > 1 else ""
+    row_values["surname"] = surname
+    row_values["first_name"] = first_name
+
+    # Staff ID is no longer used for primary naming, but we keep the value extraction
+    staff_id = norm(row_values.get("staff_id", ""))
+    if not staff_id:
+        staff_id = f"unknown_{i}"
+    row_values["staff_id"] = staff_id
+
+    # Checkbox logic
+    set_checkbox_values(row_values)
+
+    # DOB Parsing
+    dob_cell = row_values.get("day_of_birth", "")
+    d, m, y = parse_date_flexible(dob_cell)
+    row_values["day_of_birth"] = d
+    row_values["month_of_birth"] = m
+    row_values["year_of_birth"] = y
+
+    # Spouse DOB Parsing
+    spouse_cell = row_values.get("spouse_dob", "")
+    sd, sm, sy = parse_date_flexible(spouse_cell)
+    row_values["spouse_day_of_birth"] = sd
+    row_values["spouse_month_of_birth"] = sm
+    row_values["spouse_year_of_birth"] = sy
+
+    # Children DOB Formatting
+    fc_cell = row_values.get("first_child_dob", "")
+    fcd, fcm, fcy = parse_date_flexible(fc_cell)
+    row_values["first_child_dob"] = (f"{fcd}/{fcm}/{fcy}" if fcd and fcm and fcy else "").strip("/")
+
+    sc_cell = row_values.get("second_child_dob", "")
+    scd, scm, scy = parse_date_flexible(sc_cell)
+    row_values["second_child_dob"] = (f"{scd}/{scm}/{scy}" if scd and scm and scy else "").strip("/")
+
+    tc_cell = row_values.get("third_child_date", "")
+    tcd, tcm, tcy = parse_date_flexible(tc_cell)
+    row_values["third_child_date"] = (f"{tcd}/{tcm}/{tcy}" if tcd and tcm and tcy else "").strip("/")
+
+    row_values["change"] = "Yes"
+    row_values["phone_number"] = norm(row_values.get("phone_number", ""))
+    row_values["ghana_card"] = norm(row_values.get("ghana_card", ""))
+    row_values["social_sec"] = norm(row_values.get("social_sec", ""))
+    
+    # -----------------------------------------------------------------
+    # *** APPLIED FIXES: SEQUENTIAL NAMING ***
+    
+    # 1. SEQUENTIAL FILENAME LOGIC (001, 002, ...); padding comes from main()
+    out_edit = f"{EDIT_PREFIX}{i:0{padding}d}.pdf"
+    out_flat = f"{FLAT_PREFIX}{i:0{padding}d}_flat.pdf"
+    # -----------------------------------------------------------------
+    
+    row_values["year"] = YEAR_STR
+    row_values["declaration_date"] = declaration_date
+
+    try:
+        fill_template_pdf(row_values, out_edit=out_edit, out_flat=out_flat)
+    except Exception as ex:
+        return i, False, str(ex)
+    return i, True, None
 
 # ---------- main ----------
 def main():
     # 1. Read ALL sheets from the Excel file into a dictionary of DataFrames (sheet_name=None)
     try:
-        all_sheets = pd.read_excel(EXCEL_PATH, sheet_name=None, dtype=str, header=0)
+        all_sheets = read_all_sheets(EXCEL_PATH)
     except FileNotFoundError:
         print(f"ERROR: Excel file not found at '{EXCEL_PATH}'.")
         return
@@ -185,6 +398,14 @@ def main():
         print(f"ERROR loading Excel data: {e}")
         return
 
+    # Read the PDF template once; each row parses its own copy from these bytes
+    try:
+        with open(TEMPLATE_PATH, "rb") as f:
+            template_bytes = f.read()
+    except FileNotFoundError:
+        print(f"ERROR: PDF template not found at '{TEMPLATE_PATH}'.")
+        return
+
     # 2. Concatenate all sheets into one single DataFrame (df)
     df = pd.concat(all_sheets.values(), ignore_index=True)
     
@@ -193,135 +414,29 @@ def main():
     total = len(df)
     print(f"Loaded {total} rows from the following sheets: {sheet_names_processed}")
     
-    # prepare column-letter -> index mapping for quick access
-    col_to_idx = {col: col_letter_to_index(col) for col in COL_MAP.keys()}
-
-    for i, row_series in enumerate(df.itertuples(index=False, name=None), 1):
-        def cell(letter):
-            try:
-                idx = col_letter_to_index(letter)
-                return row_series[idx] if idx < len(row_series) else None
-            except Exception:
-                return None
-
-        row_values = {}
-
-        # Populate simple mapped fields from COL_MAP
-        for col_letter, key in COL_MAP.items():
-            val = norm(cell(col_letter))
-            row_values[key] = val
-
-        # --- extract only the year from the timestamp column (B) ---
-        timestamp = norm(cell("B"))
-        year_part = ""
-        if timestamp:
-            # Try to extract a 4-digit or 2-digit year
-            m = re.search(r'(\d{4})', timestamp)
-            if not m:
-                m = re.search(r'(\d{2})', timestamp)
-            if m:
-                y = m.group(1)
-                if len(y) == 2:
-                    year_part = "20" + y
-                else:
-                    year_part = y
-        row_values["year"] = year_part
-
-        # split name in name_cell -> surname, first_name
-        name_cell = row_values.get("name_cell", "")
-        surname = ""
-        first_name = ""
-        if name_cell:
-            parts = re.split(r'\s+', name_cell.strip())
-            if len(parts) >= 1:
-                surname = parts[0]
-                first_name = " ".join(parts[1:]) if len(parts) > 1 else ""
-        row_values["surname"] = surname
-        row_values["first_name"] = first_name
-
-        # Staff ID is no longer used for primary naming, but we keep the value extraction
-        staff_id = norm(row_values.get("staff_id", ""))
-        if not staff_id:
-            staff_id = f"unknown_{i}"
-        row_values["staff_id"] = staff_id
-
-        # Checkbox logic
-        gender_raw = norm(row_values.get("gender", ""))
-        row_values["male"] = "Yes" if gender_raw.lower().startswith("m") else ""
-        row_values["female"] = "Yes" if gender_raw.lower().startswith("f") else ""
-
-        marital_raw = norm(row_values.get("marital", ""))
-        row_values["married"] = "Yes" if "married" in marital_raw.lower() else ""
-        row_values["single"] = "Yes" if "single" in marital_raw.lower() else ""
-
-        dis_raw = norm(row_values.get("disabled", ""))
-        if dis_raw:
-            if dis_raw.lower().startswith("y"):
-                row_values["disabled"] = "Yes"
-                row_values["not_disabled"] = ""
+    # DIRECTORY SAFETY CHECK (prevents [Errno 2]), done once for all rows
+    os.makedirs(OUT_EDITABLE, exist_ok=True)
+    os.makedirs(OUT_FLATTENED, exist_ok=True)
+
+    padding = len(str(total))
+    # Same date for every form in the run; read the clock once
+    declaration_date = datetime.today().strftime("%d/%m/%Y")
+    arr = gather_columns(df)
+    # Blank / timestamp-only rows (common at the end of Forms exports) are skipped
+    rows = [(i, padding, declaration_date, row) for i, row in enumerate(arr, 1) if row_has_data(row)]
+    skipped = total - len(rows)
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker,
+                             initargs=(template_bytes,)) as executor:
+        for i, ok, err in executor.map(process_row, rows, chunksize=16):
+            new_file_name = f"{i:0{padding}d}"
+            if ok:
+                print(f"[{i}/{total}] Generated {new_file_name}")
             else:
-                row_values["disabled"] = ""
-                row_values["not_disabled"] = "Yes"
-        else:
-            row_values["disabled"] = ""
-            row_values["not_disabled"] = ""
+                # We now use the sequential name in the error message
+                print(f"ERROR processing row {i} (File: {new_file_name}): {err}")
 
-        # DOB Parsing
-        dob_cell = row_values.get("day_of_birth", "")
-        d, m, y = parse_date_flexible(dob_cell)
-        row_values["day_of_birth"] = d
-        row_values["month_of_birth"] = m
-        row_values["year_of_birth"] = y
-
-        # Spouse DOB Parsing
-        spouse_cell = row_values.get("spouse_dob", "")
-        sd, sm, sy = parse_date_flexible(spouse_cell)
-        row_values["spouse_day_of_birth"] = sd
-        row_values["spouse_month_of_birth"] = sm
-        row_values["spouse_year_of_birth"] = sy
-
-        # Children DOB Formatting
-        fc_cell = row_values.get("first_child_dob", "")
-        fcd, fcm, fcy = parse_date_flexible(fc_cell)
-        row_values["first_child_dob"] = (f"{fcd}/{fcm}/{fcy}" if fcd and fcm and fcy else "").strip("/")
-
-        sc_cell = row_values.get("second_child_dob", "")
-        scd, scm, scy = parse_date_flexible(sc_cell)
-        row_values["second_child_dob"] = (f"{scd}/{scm}/{scy}" if scd and scm and scy else "").strip("/")
-
-        tc_cell = row_values.get("third_child_date", "")
-        tcd, tcm, tcy = parse_date_flexible(tc_cell)
-        row_values["third_child_date"] = (f"{tcd}/{tcm}/{tcy}" if tcd and tcm and tcy else "").strip("/")
-
-        row_values["change"] = "Yes"
-        row_values["phone_number"] = norm(row_values.get("phone_number", ""))
-        row_values["ghana_card"] = norm(row_values.get("ghana_card", ""))
-        row_values["social_sec"] = norm(row_values.get("social_sec", ""))
-        
-        # -----------------------------------------------------------------
-        # *** APPLIED FIXES: SEQUENTIAL NAMING & DIRECTORY SAFETY ***
-        
-        # 1. SEQUENTIAL FILENAME LOGIC (001, 002, ...)
-        padding = len(str(total)) 
-        new_file_name = f"{i:0{padding}d}"
-
-        out_edit = os.path.join(OUT_EDITABLE, f"{new_file_name}.pdf")
-        out_flat = os.path.join(OUT_FLATTENED, f"{new_file_name}_flat.pdf")
-        
-        # 2. DIRECTORY SAFETY CHECK (prevents [Errno 2])
-        os.makedirs(OUT_EDITABLE, exist_ok=True)
-        os.makedirs(OUT_FLATTENED, exist_ok=True)
-        # -----------------------------------------------------------------
-        
-        row_values["year"] = "2026"
-        row_values["declaration_date"] = datetime.today().strftime("%d/%m/%Y")
-
-        print(f"[{i}/{total}] Generating {new_file_name}")
-        try:
-            fill_pdf(TEMPLATE_PATH, out_edit, out_flat, row_values)
-        except Exception as ex:
-            # We now use the sequential name in the error message
-            print(f"ERROR processing row {i} (File: {new_file_name}): {ex}")
+    if skipped:
+        print(f"Skipped {skipped} empty row(s)")
 
 
 if __name__ == "__main__":
@@ -1,89 +1,121 @@
 import streamlit as st
 import pandas as pd
+import multiprocessing
 import os
+import shutil
 import zipfile
-import io
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from fill_form_from_excel_by_col import fill_pdf, parse_date_flexible, norm, COL_MAP
+from fill_form_from_excel_by_col import (
+    fill_pdf_batch, gather_columns, row_has_data, read_all_sheets,
+    parse_date_flexible, set_checkbox_values, norm, ROW_KEYS, YEAR_STR,
+)
 
-st.set_page_config(page_title="PDF Filler", page_icon="📄")
-st.title("📄 PDF Form Auto-Filler")
+@st.cache_resource
+def get_pool():
+    # One worker pool per server process, reused across runs. "spawn" because
+    # forking the multi-threaded Streamlit server can deadlock.
+    return ProcessPoolExecutor(max_workers=os.cpu_count(),
+                               mp_context=multiprocessing.get_context("spawn"))
 
-uploaded_excel = st.file_uploader("Upload Excel", type=["xlsx"])
-uploaded_template = st.file_uploader("Upload PDF Template", type=["pdf"])
+# Spawned pool workers re-run this script as __mp_main__ (before
+# multiprocessing.parent_process() is set); only the Streamlit run builds the page
+if __name__ != "__mp_main__":
+    st.set_page_config(page_title="PDF Filler", page_icon="📄")
+    st.title("📄 PDF Form Auto-Filler")
 
-if uploaded_excel and uploaded_template:
-    if st.button("🚀 Start Generating"):
-        # Create directories
-        flat_dir = "output_flat"
-        # Cleanup old files if they exist from a previous failed run
-        if os.path.exists(flat_dir):
-            import shutil
-            shutil.rmtree(flat_dir)
-        os.makedirs(flat_dir, exist_ok=True)
+    uploaded_excel = st.file_uploader("Upload Excel", type=["xlsx"])
+    uploaded_template = st.file_uploader("Upload PDF Template", type=["pdf"])
+
+    if uploaded_excel and uploaded_template:
+        if st.button("🚀 Start Generating"):
+            # Create directories
+            flat_dir = "output_flat"
+            # Cleanup old files if they exist from a previous failed run
+            if os.path.exists(flat_dir):
+                shutil.rmtree(flat_dir)
+            os.makedirs(flat_dir, exist_ok=True)
         
-        # Save template
-        with open("temp_template.pdf", "wb") as f:
-            f.write(uploaded_template.getbuffer())
+            # Keep the template in memory; fill_pdf parses it from bytes per row
+            template_bytes = uploaded_template.getvalue()
 
-        try:
-            all_sheets = pd.read_excel(uploaded_excel, sheet_name=None, dtype=str, header=0)
-            df = pd.concat(all_sheets.values(), ignore_index=True)
-            total = len(df)
+            try:
+                all_sheets = read_all_sheets(uploaded_excel)
+                df = pd.concat(all_sheets.values(), ignore_index=True)
+                total = len(df)
             
-            bar = st.progress(0)
-            status = st.empty()
+                bar = st.progress(0)
+                status = st.empty()
             
-            for i, row in enumerate(df.itertuples(index=False, name=None), 1):
-                row_values = {}
-                # Logic to fill row_values based on your COL_MAP
-                for col_letter, key in COL_MAP.items():
-                    # Manual letter-to-index conversion to avoid dependency issues
-                    letter = col_letter.strip().upper()
-                    idx = 0
-                    for ch in letter:
-                        idx = idx * 26 + (ord(ch) - ord('A') + 1)
-                    col_idx = idx - 1
-                    row_values[key] = norm(row[col_idx]) if col_idx < len(row) else ""
+                # Row values are cheap to build here; the PDF writing goes to worker processes
+                padding = len(str(total))
+                declaration_date = datetime.today().strftime("%d/%m/%Y")
+                jobs = []
+                for i, row in enumerate(gather_columns(df), 1):
+                    if not row_has_data(row):
+                        continue
+                    # Logic to fill row_values based on your COL_MAP
+                    row_values = dict(zip(ROW_KEYS, map(norm, row)))
 
-                # Derived fields
-                name_cell = row_values.get("name_cell", "")
-                parts = name_cell.split()
-                row_values["surname"] = parts[0] if len(parts) > 0 else ""
-                row_values["first_name"] = " ".join(parts[1:]) if len(parts) > 1 else ""
-                d, m, y = parse_date_flexible(row_values.get("day_of_birth", ""))
-                row_values["day_of_birth"], row_values["month_of_birth"], row_values["year_of_birth"] = d, m, y
-                row_values["change"] = "Yes"
-                row_values["year"] = "2026"
-                row_values["declaration_date"] = datetime.today().strftime("%d/%m/%Y")
+                    # Derived fields
+                    name_cell = row_values.get("name_cell", "")
+                    parts = name_cell.split()
+                    row_values["surname"] = parts[0] if len(parts) > 0 else ""
+                    row_values["first_name"] = " ".join(parts[1:]) if len(parts) > 1 else ""
+                    d, m, y = parse_date_flexible(row_values.get("day_of_birth", ""))
+                    row_values["day_of_birth"], row_values["month_of_birth"], row_values["year_of_birth"] = d, m, y
+                    set_checkbox_values(row_values)
+                    row_values["change"] = "Yes"
+                    row_values["year"] = YEAR_STR
+                    row_values["declaration_date"] = declaration_date
 
-                # Generate File
-                padding = len(str(total))
-                fname = f"{i:0{padding}d}.pdf"
-                out_path = os.path.join(flat_dir, fname)
-                
-                # Fill the PDF
-                fill_pdf("temp_template.pdf", "temp_dummy.pdf", out_path, row_values)
-                
-                bar.progress(i / total)
-                status.text(f"Generated {i}/{total}")
+                    # Generate File
+                    fname = f"{i:0{padding}d}.pdf"
+                    out_path = os.path.join(flat_dir, fname)
+
+                    # Fill the PDF (flat version only; we'll just use the flat versions)
+                    jobs.append((row_values, out_path))
+
+                # The pool outlives this run, so the template travels with each batch
+                # rather than through a worker initializer
+                pool = get_pool()
+                batch_size = max(1, len(jobs) // ((os.cpu_count() or 1) * 4))
+                try:
+                    futures = [
+                        pool.submit(fill_pdf_batch, template_bytes, jobs[start:start + batch_size])
+                        for start in range(0, len(jobs), batch_size)
+                    ]
+                    done = 0
+                    for future in as_completed(futures):
+                        done += future.result()
+                        bar.progress(done / len(jobs))
+                        status.text(f"Generated {done}/{len(jobs)}")
+                except BrokenProcessPool:
+                    # A worker died (OOM kill, segfault); drop the dead pool so only this run fails
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    get_pool.clear()
+                    raise
 
-            # --- THE MEMORY FIX: Write ZIP to disk, not RAM ---
-            zip_filename = "final_output.zip"
-            with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for root, _, files in os.walk(flat_dir):
-                    for f in files:
-                        zf.write(os.path.join(root, f), f)
+                # --- THE MEMORY FIX: Write ZIP to disk, not RAM ---
+                zip_filename = "final_output.zip"
+                # ZIP_STORED: the PDF streams are already Flate-compressed, so deflating again is mostly wasted CPU
+                with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_STORED) as zf:
+                    for root, _, files in os.walk(flat_dir):
+                        for f in files:
+                            zf.write(os.path.join(root, f), f)
+                # The PDFs now live in the ZIP; drop the intermediate directory
+                shutil.rmtree(flat_dir)
             
-            st.success("🎉 All files created successfully!")
+                st.success("🎉 All files created successfully!")
             
-            # Provide the download by reading the file back
-            with open(zip_filename, "rb") as f:
-                st.download_button(
-                    label="📥 Download ZIP",
-                    data=f,
-                    file_name="filled_forms.zip",
-                    mime="application/zip"
-                )
-        except Exception as e:
-            st.error(f"Processing Error: {e}")
+                # Provide the download by reading the file back
+                with open(zip_filename, "rb") as f:
+                    st.download_button(
+                        label="📥 Download ZIP",
+                        data=f,
+                        file_name="filled_forms.zip",
+                        mime="application/zip"
+                    )
+            except Exception as e:
+                st.error(f"Processing Error: {e}")